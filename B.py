@@ -4,20 +4,28 @@ import time
 import logging
 import asyncio
 import json
-import requests
-from datetime import datetime, timedelta
-from typing import Dict, Set, List, Tuple
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.enums import ChatType
+import functools
+from collections import ChainMap
+from string import Formatter
+import aiohttp
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+from pyrogram import Client, filters, idle
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.enums import ChatType, ChatMemberStatus
 from pyrogram.errors import FloodWait
 import configparser
-from pymongo import MongoClient
-import redis
-from flask import Flask, render_template
+from pymongo import ReturnDocument, UpdateOne
+from motor.motor_asyncio import AsyncIOMotorClient
+import redis.asyncio as redis
+from cachetools import TTLCache
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# The format above never prints thread or process info, so skip collecting it per record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 logger = logging.getLogger(__name__)
 
 # Load configuration
@@ -34,36 +42,99 @@ redis_port = config["Redis"]["port"]
 app = Client("WordSeekBot", api_id=api_id, api_hash=api_hash, bot_token=bot_token)
 
 # MongoDB setup
-mongo_client = MongoClient(mongo_uri)
+mongo_client = AsyncIOMotorClient(mongo_uri)
 db = mongo_client["wordseek"]
 games_coll = db["games"]
 scores_coll = db["scores"]
 stats_coll = db["stats"]
 bot_stats_coll = db["bot_stats"]
 users_coll = db["users"]
+leaderboard_mv = db["leaderboard_mv"]
 
 # Redis setup for rate limiting
 try:
     redis_client = redis.Redis(host=redis_host, port=int(redis_port), decode_responses=True)
 except Exception as e:
-    logger.warning(f"Redis connection failed: {e}, falling back to in-memory rate limiting")
+    logger.warning("Redis connection failed: %s, falling back to in-memory rate limiting", e)
     redis_client = None
 
-# Flask setup for analytics dashboard
-flask_app = Flask(__name__)
+# Shared HTTP session with a keep-alive connection pool, created in on_startup
+http_session: aiohttp.ClientSession = None
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.2  # seconds, doubled after each failed attempt
 
-# Word source (Datamuse API)
-def fetch_words(length: int = 5, max_words: int = 1000) -> List[str]:
-    try:
-        response = requests.get(f"https://api.datamuse.com/words?ml=word&max={max_words}&sp={'?' * length}")
-        words = [word["word"].lower() for word in response.json() if len(word["word"]) == length and word["word"].isalpha()]
-        logger.info(f"Fetched {len(words)} words from Datamuse")
-        return words
-    except Exception as e:
-        logger.error(f"Error fetching words: {e}")
-        return ["apple", "brave", "cloud", "dream", "eagle", "flame", "grape", "house", "jolly", "knife"]
+def create_http_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300),
+        timeout=aiohttp.ClientTimeout(total=3)
+    )
 
-WORDS = fetch_words()
+# Background tasks: the event loop only keeps weak references, so hold them until they finish
+_TASKS: Set[asyncio.Task] = set()
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
+    return task
+
+# Word source (Datamuse API); fetch_words returns None once every retry has failed
+FALLBACK_WORDS = ["apple", "brave", "cloud", "dream", "eagle", "flame", "grape", "house", "jolly", "knife"]
+
+async def fetch_words(length: int = 5, max_words: int = 1000) -> Optional[List[str]]:
+    url = f"https://api.datamuse.com/words?ml=word&max={max_words}&sp={'?' * length}"
+    for attempt in range(HTTP_RETRIES):
+        try:
+            async with http_session.get(url) as response:
+                response.raise_for_status()
+                data = await response.json()
+            # get_hint indexes its letter counts by a-z, so accented words are skipped
+            words = [word["word"].lower() for word in data
+                     if len(word["word"]) == length and word["word"].isascii() and word["word"].isalpha()]
+            logger.info("Fetched %s words from Datamuse", len(words))
+            return words
+        except Exception as e:
+            logger.error("Error fetching words (attempt %s/%s): %s", attempt + 1, HTTP_RETRIES, e)
+            if attempt + 1 < HTTP_RETRIES:
+                await asyncio.sleep(HTTP_BACKOFF * 2 ** attempt)
+    return None
+
+# Word cache keyed by word length, refreshed in the background
+WORD_REFRESH_INTERVAL = 6 * 3600  # seconds
+WORD_RETRY_INTERVAL = 300  # seconds, after a failed fetch
+_WORD_CACHE: Dict[int, List[str]] = {}
+_WORD_SETS: Dict[int, FrozenSet[str]] = {}
+_word_lock = asyncio.Lock()
+
+def _store_words(length: int, words: List[str]):
+    _WORD_CACHE[length] = words
+    _WORD_SETS[length] = frozenset(words)
+
+async def _refresh_words(length: int, delay: float):
+    while True:
+        await asyncio.sleep(delay)
+        words = await fetch_words(length)
+        if words is None:
+            # Keep serving the cached list (or the fallback) and try again soon
+            delay = WORD_RETRY_INTERVAL
+            continue
+        _store_words(length, words)
+        delay = WORD_REFRESH_INTERVAL
+
+async def get_words(length: int) -> List[str]:
+    if length in _WORD_CACHE:
+        return _WORD_CACHE[length]
+    async with _word_lock:
+        if length not in _WORD_CACHE:
+            words = await fetch_words(length)
+            _store_words(length, FALLBACK_WORDS if words is None else words)
+            spawn(_refresh_words(length, WORD_RETRY_INTERVAL if words is None else WORD_REFRESH_INTERVAL))
+    return _WORD_CACHE[length]
+
+async def get_word_set(length: int) -> FrozenSet[str]:
+    if length not in _WORD_SETS:
+        await get_words(length)
+    return _WORD_SETS[length]
 
 # Localization
 LANGUAGES = {
@@ -115,6 +186,18 @@ LANGUAGES = {
     }
 }
 
+def compile_template(template: str) -> Callable[..., str]:
+    # Generate `lambda *, field, ...: f"<template>"` so the format string is parsed once, here
+    fields = sorted({name for _, name, _, _ in Formatter().parse(template) if name})
+    params = f"*, {', '.join(fields)}" if fields else ""
+    return eval(f"lambda {params}: f{template!r}")
+
+# Templates are trusted constants; missing translations fall back to English
+MESSAGES: Dict[str, Dict[str, Callable[..., str]]] = {
+    lang: {key: compile_template(template) for key, template in ChainMap(strings, LANGUAGES["en"]).items()}
+    for lang, strings in LANGUAGES.items()
+}
+
 # Game settings
 DEFAULT_SETTINGS = {
     "max_guesses": 30,
@@ -125,104 +208,304 @@ DEFAULT_SETTINGS = {
 }
 
 # Achievements
+# Each achievement unlocks once the stats field reaches the threshold (evaluated in Mongo)
 ACHIEVEMENTS = {
-    "first_win": {"name": "First Win", "condition": lambda stats: stats.get("wins", 0) >= 1},
-    "ten_wins": {"name": "Deca-Winner", "condition": lambda stats: stats.get("wins", 0) >= 10},
-    "hundred_guesses": {"name": "Guess Master", "condition": lambda stats: stats.get("total_guesses", 0) >= 100}
+    "first_win": {"name": "First Win", "field": "wins", "threshold": 1},
+    "ten_wins": {"name": "Deca-Winner", "field": "wins", "threshold": 10},
+    "hundred_guesses": {"name": "Guess Master", "field": "total_guesses", "threshold": 100}
 }
 
+# Only the most recent guesses are kept on the game doc; guess_count tracks the total
+GUESS_HISTORY_LIMIT = 100
+
 # Rate limiting
 RATE_LIMIT = 2  # seconds
 user_last_guess: Dict[int, float] = {}
 
+# Shared handler preamble: resolve the user's language once and gate admin-only commands
+def with_lang(handler):
+    @functools.wraps(handler)
+    async def wrapper(client: Client, update):
+        update.lang = await get_user_language(update.from_user.id)
+        return await handler(client, update)
+    return wrapper
+
+def requires_admin(handler):
+    @functools.wraps(handler)
+    async def wrapper(client: Client, message: Message):
+        if not await is_admin(message.chat.id, message.from_user.id, message):
+            await message.reply(MESSAGES[message.lang]["admin_only"]())
+            return
+        return await handler(client, message)
+    return wrapper
+
+# Per-chat work queues: updates of one chat run in order, different chats run concurrently
+CHAT_QUEUE_SIZE = 100
+chat_workers: Dict[int, asyncio.Queue] = {}
+
+async def _chat_worker(chat_id: int, queue: asyncio.Queue):
+    while not queue.empty():
+        handler, client, update = queue.get_nowait()
+        try:
+            await handler(client, update)
+        except Exception as e:
+            logger.error("Error handling update in chat %s: %s", chat_id, e)
+    chat_workers.pop(chat_id, None)
+
+def per_chat(handler):
+    @functools.wraps(handler)
+    async def enqueue(client: Client, update):
+        chat_id = update.message.chat.id if isinstance(update, CallbackQuery) else update.chat.id
+        queue = chat_workers.get(chat_id)
+        if queue is None:
+            queue = chat_workers[chat_id] = asyncio.Queue(maxsize=CHAT_QUEUE_SIZE)
+            spawn(_chat_worker(chat_id, queue))
+        try:
+            queue.put_nowait((handler, client, update))
+        except asyncio.QueueFull:
+            logger.warning("Dropping update for chat %s: queue full", chat_id)
+    return enqueue
+
+# In-process caches for per-message lookups
+_lang_cache = TTLCache(maxsize=10000, ttl=300)
+_admin_cache = TTLCache(maxsize=5000, ttl=60)
+
 # Helper functions
-def is_admin(chat_id: int, user_id: int, message: Message) -> bool:
+async def is_admin(chat_id: int, user_id: int, message: Message) -> bool:
     if message.chat.type == ChatType.PRIVATE:
         return True
+    key = (chat_id, user_id)
+    if key in _admin_cache:
+        return _admin_cache[key]
     try:
-        member = app.get_chat_member(chat_id, user_id)
-        return member.status in ["administrator", "creator"]
+        member = await app.get_chat_member(chat_id, user_id)
     except Exception as e:
-        logger.error(f"Error checking admin status: {e}")
+        logger.error("Error checking admin status: %s", e)
         return False
+    _admin_cache[key] = member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+    return _admin_cache[key]
 
 def get_hint(guess: str, target: str) -> str:
-    hint = []
-    target_list = list(target)
-    for i in range(len(guess)):
-        if guess[i] == target[i]:
-            hint.append("🟩")
-            target_list[i] = None
-        elif guess[i] in target_list:
-            hint.append("🟨")
-            target_list[target_list.index(guess[i])] = None
+    # Two passes over per-letter counts of the unmatched target letters (a-z)
+    hint = ["🟥"] * len(guess)
+    counts = bytearray(26)
+    for i, (g, t) in enumerate(zip(guess, target)):
+        if g == t:
+            hint[i] = "🟩"
         else:
-            hint.append("🟥")
+            counts[ord(t) - 97] += 1
+    for i, (g, t) in enumerate(zip(guess, target)):
+        if g != t and counts[ord(g) - 97]:
+            hint[i] = "🟨"
+            counts[ord(g) - 97] -= 1
     return "".join(hint)
 
-def update_score(user_id: int, chat_id: int, mode: str, team: str = None):
-    now = datetime.now()
-    update = {
-        "$inc": {
-            f"scores.{chat_id}.all_time": 1,
-            f"scores.{chat_id}.today": 1 if now.date() == datetime.now().date() else 0,
-            f"scores.{chat_id}.week": 1 if now.isocalendar().week == datetime.now().isocalendar().week else 0,
-            f"scores.{chat_id}.month": 1 if now.month == datetime.now().month else 0,
-            f"global.all_time": 1,
-            f"global.today": 1 if now.date() == datetime.now().date() else 0,
-            f"global.week": 1 if now.isocalendar().week == datetime.now().isocalendar().week else 0,
-            f"global.month": 1 if now.month == datetime.now().month else 0
-        }
-    }
+# Scores are stored as daily buckets {user_id, chat_id, date, wins} plus one all-time
+# bucket per (user_id, chat_id) with date=None; daily buckets expire via a TTL index
+SCORE_RETENTION_DAYS = 60
+
+def period_starts() -> Dict[str, datetime]:
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return {"today": today, "week": today - timedelta(days=today.weekday()), "month": today.replace(day=1)}
+
+async def update_score(user_id: int, chat_id: int, first_name: str, mode: str, team: str = None):
+    update = {"$inc": {"wins": 1}, "$set": {"first_name": first_name}}
     if mode == "team" and team:
         update["$inc"][f"teams.{team}.score"] = 1
-    scores_coll.update_one({"user_id": user_id}, update, upsert=True)
-    stats_coll.update_one({"user_id": user_id}, {"$inc": {"wins": 1}}, upsert=True)
-
-def update_stats(user_id: int, guesses: int):
-    stats_coll.update_one(
-        {"user_id": user_id},
-        {"$inc": {"games_played": 1, "total_guesses": guesses}},
-        upsert=True
-    )
-    bot_stats_coll.update_one(
+    await scores_coll.bulk_write([
+        UpdateOne({"user_id": user_id, "chat_id": chat_id, "date": period_starts()["today"]}, update, upsert=True),
+        UpdateOne({"user_id": user_id, "chat_id": chat_id, "date": None}, update, upsert=True)
+    ], ordered=False)
+    if redis_client:
+        try:
+            await mirror_score(user_id, chat_id, first_name)
+        except Exception as e:
+            logger.error("Error mirroring score to Redis: %s", e)
+
+async def update_stats(user_id: int, guesses: int, wins: int = 0):
+    inc = {"games_played": 1, "total_guesses": guesses}
+    if wins:
+        inc["wins"] = wins
+    await stats_coll.update_one({"user_id": user_id}, {"$inc": inc}, upsert=True)
+    await bot_stats_coll.update_one(
         {"_id": 1},
         {"$inc": {"guesses_made": guesses, "games_started": 0}, "$set": {"last_updated": time.time()}},
         upsert=True
     )
 
-def check_achievements(user_id: int) -> List[str]:
-    user_stats = stats_coll.find_one({"user_id": user_id}) or {}
-    unlocked = []
-    for ach_id, ach in ACHIEVEMENTS.items():
-        if ach["condition"](user_stats) and ach_id not in user_stats.get("achievements", []):
-            unlocked.append(ach["name"])
-            stats_coll.update_one(
-                {"user_id": user_id},
-                {"$addToSet": {"achievements": ach_id}},
-                upsert=True
-            )
-    return unlocked
-
-def get_leaderboard(scope: str, chat_id: int, period: str, page: int = 1, per_page: int = 5) -> Tuple[str, InlineKeyboardMarkup]:
+async def check_achievements(user_id: int) -> List[str]:
+    earned = {"$concatArrays": [
+        {"$cond": [{"$gte": [{"$ifNull": [f"${ach['field']}", 0]}, ach["threshold"]]}, [ach_id], []]}
+        for ach_id, ach in ACHIEVEMENTS.items()
+    ]}
+    owned = {"$ifNull": ["$achievements", []]}
+    user_stats = await stats_coll.find_one_and_update(
+        {"user_id": user_id},
+        [
+            {"$set": {"new_achievements": {"$setDifference": [earned, owned]}}},
+            {"$set": {"achievements": {"$setUnion": [owned, "$new_achievements"]}}}
+        ],
+        projection={"new_achievements": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    unlocked = user_stats.get("new_achievements", []) if user_stats else []
+    return [ACHIEVEMENTS[ach_id]["name"] for ach_id in unlocked]
+
+# Leaderboard materialized view, rebuilt from scores_coll every LEADERBOARD_REFRESH_INTERVAL
+LEADERBOARD_REFRESH_INTERVAL = 300  # seconds
+PERIODS = ["today", "week", "month", "all_time"]
+
+async def refresh_leaderboards():
+    refreshed_at = time.time()
+    starts = period_starts()
+    rollup = [
+        {"$match": {"$or": [{"date": None}, {"date": {"$gte": min(starts.values())}}]}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "chat_id": "$chat_id"},
+            "first_name": {"$last": "$first_name"},
+            "all_time": {"$sum": {"$cond": [{"$eq": ["$date", None]}, "$wins", 0]}},
+            **{p: {"$sum": {"$cond": [{"$gte": ["$date", start]}, "$wins", 0]}} for p, start in starts.items()}
+        }},
+        {"$project": {"_id": 0, "user_id": "$_id.user_id", "chat_id": "$_id.chat_id", "first_name": 1, **{p: 1 for p in PERIODS}}}
+    ]
+    per_chat = [
+        {"$project": {
+            "user_id": 1,
+            "first_name": 1,
+            "scope": {"$literal": "scores"},
+            "chat_id": 1,
+            "period": {"$objectToArray": {p: f"${p}" for p in PERIODS}}
+        }}
+    ]
+    per_user = [
+        {"$group": {
+            "_id": "$user_id",
+            "first_name": {"$last": "$first_name"},
+            **{p: {"$sum": f"${p}"} for p in PERIODS}
+        }},
+        {"$project": {
+            "user_id": "$_id",
+            "first_name": 1,
+            "scope": {"$literal": "global"},
+            "chat_id": {"$literal": 0},
+            "period": {"$objectToArray": {p: f"${p}" for p in PERIODS}}
+        }}
+    ]
+    merge = [
+        {"$unwind": "$period"},
+        {"$match": {"period.v": {"$gt": 0}}},
+        {"$project": {
+            "_id": 0,
+            "scope": 1,
+            "chat_id": 1,
+            "user_id": 1,
+            "first_name": 1,
+            "period": "$period.k",
+            "score": "$period.v",
+            "refreshed_at": {"$literal": refreshed_at}
+        }},
+        {"$merge": {
+            "into": leaderboard_mv.name,
+            "on": ["scope", "chat_id", "period", "user_id"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+    await scores_coll.aggregate(rollup + per_chat + merge).to_list(None)
+    await scores_coll.aggregate(rollup + per_user + merge).to_list(None)
+    await leaderboard_mv.delete_many({"refreshed_at": {"$lt": refreshed_at}})
+
+async def _refresh_leaderboards_loop():
+    while True:
+        try:
+            await refresh_leaderboards()
+            if redis_client:
+                await seed_redis_leaderboards()
+        except Exception as e:
+            logger.error("Error refreshing leaderboards: %s", e)
+        await asyncio.sleep(LEADERBOARD_REFRESH_INTERVAL)
+
+# Real-time leaderboards mirrored into Redis sorted sets; Mongo stays the source of truth.
+# The sets are rebuilt from leaderboard_mv after every refresh and only served once
+# LEADERBOARD_SEEDED_KEY exists, so Redis never answers with just the wins mirrored since a deploy or flush.
+LEADERBOARD_NAMES_KEY = "lb:names"
+LEADERBOARD_SEEDED_KEY = "lb:seeded"
+PERIOD_KEY_TTLS = {"today": 2 * 86400, "week": 8 * 86400, "month": 32 * 86400}
+
+def leaderboard_key(scope: str, chat_id: int, period: str) -> str:
+    prefix = f"lb:chat:{chat_id}" if scope == "scores" else "lb:global"
+    if period == "all_time":
+        return f"{prefix}:all"
+    start = period_starts()[period]
+    return f"{prefix}:{period}:{start:%Y%m%d}"
+
+async def mirror_score(user_id: int, chat_id: int, first_name: str):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for scope in ("scores", "global"):
+            for period in PERIODS:
+                key = leaderboard_key(scope, chat_id, period)
+                pipe.zincrby(key, 1, user_id)
+                if period in PERIOD_KEY_TTLS:
+                    pipe.expire(key, PERIOD_KEY_TTLS[period])
+        pipe.hset(LEADERBOARD_NAMES_KEY, user_id, first_name)
+        await pipe.execute()
+
+async def seed_redis_leaderboards():
+    boards: Dict[str, Tuple[str, Dict[int, int]]] = {}
+    names: Dict[int, str] = {}
+    async for row in leaderboard_mv.find({}, {"_id": 0, "scope": 1, "chat_id": 1, "period": 1, "user_id": 1, "first_name": 1, "score": 1}):
+        key = leaderboard_key(row["scope"], row["chat_id"], row["period"])
+        boards.setdefault(key, (row["period"], {}))[1][row["user_id"]] = row["score"]
+        if row.get("first_name"):
+            names[row["user_id"]] = row["first_name"]
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for key, (period, scores) in boards.items():
+            pipe.delete(key)
+            pipe.zadd(key, scores)
+            if period in PERIOD_KEY_TTLS:
+                pipe.expire(key, PERIOD_KEY_TTLS[period])
+        if names:
+            pipe.hset(LEADERBOARD_NAMES_KEY, mapping=names)
+        pipe.set(LEADERBOARD_SEEDED_KEY, int(time.time()))
+        await pipe.execute()
+
+async def _redis_leaderboard(scope: str, chat_id: int, period: str, page: int, per_page: int):
+    key = leaderboard_key(scope, chat_id, period)
+    start = (page - 1) * per_page
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.exists(LEADERBOARD_SEEDED_KEY)
+        pipe.zcard(key)
+        pipe.zrevrange(key, start, start + per_page - 1, withscores=True)
+        seeded, total, rows = await pipe.execute()
+    if not seeded or not total:
+        return None
+    names = await redis_client.hmget(LEADERBOARD_NAMES_KEY, [user_id for user_id, _ in rows]) if rows else []
+    return [(name or user_id, int(score)) for (user_id, score), name in zip(rows, names)], total
+
+async def _mv_leaderboard(scope: str, chat_id: int, period: str, page: int, per_page: int):
     pipeline = [
-        {"$match": {f"{scope}.{period}": {"$gt": 0}}},
-        {"$sort": {f"{scope}.{period}": -1}},
-        {"$skip": (page - 1) * per_page},
-        {"$limit": per_page}
+        {"$match": {"scope": scope, "chat_id": chat_id if scope == "scores" else 0, "period": period}},
+        {"$sort": {"score": -1}},
+        {"$facet": {
+            "rows": [{"$skip": (page - 1) * per_page}, {"$limit": per_page}],
+            "total": [{"$count": "count"}]
+        }}
     ]
-    if scope == "scores":
-        pipeline[0]["$match"]["scores.chat_id"] = chat_id
-    
-    leaderboard = []
-    for user in scores_coll.aggregate(pipeline):
+    facet = (await leaderboard_mv.aggregate(pipeline).to_list(1))[0]
+    leaderboard = [(row.get("first_name") or str(row["user_id"]), row["score"]) for row in facet["rows"]]
+    total = facet["total"][0]["count"] if facet["total"] else 0
+    return leaderboard, total
+
+async def get_leaderboard(scope: str, chat_id: int, period: str, page: int = 1, per_page: int = 5) -> Tuple[str, InlineKeyboardMarkup]:
+    ranked = None
+    if redis_client:
         try:
-            user_info = app.get_users(user["user_id"])
-            leaderboard.append((user_info.first_name, user[scope][period]))
+            ranked = await _redis_leaderboard(scope, chat_id, period, page, per_page)
         except Exception as e:
-            logger.error(f"Error fetching user {user['user_id']}: {e}")
-    
-    total = scores_coll.count_documents({f"{scope}.{period}": {"$gt": 0}})
+            logger.error("Error reading leaderboard from Redis: %s", e)
+    if ranked is None:
+        ranked = await _mv_leaderboard(scope, chat_id, period, page, per_page)
+    leaderboard, total = ranked
     result = f"{scope.capitalize()} Leaderboard ({period}):\n"
     for i, (name, score) in enumerate(leaderboard, 1 + (page - 1) * per_page):
         result += f"{i}. {name}: {score}\n"
@@ -232,35 +515,27 @@ def get_leaderboard(scope: str, chat_id: int, period: str, page: int = 1, per_pa
     
     buttons = []
     if page > 1:
-        buttons.append(InlineKeyboardButton("Previous", callback_data=f"leaderboard_{scope}_{period}_{page-1}"))
+        buttons.append(InlineKeyboardButton("Previous", callback_data=f"lb:{scope}:{period}:{page-1}"))
     if total > page * per_page:
-        buttons.append(InlineKeyboardButton("Next", callback_data=f"leaderboard_{scope}_{period}_{page+1}"))
+        buttons.append(InlineKeyboardButton("Next", callback_data=f"lb:{scope}:{period}:{page+1}"))
     keyboard = InlineKeyboardMarkup([buttons]) if buttons else None
     
     return result, keyboard
 
-def get_user_language(user_id: int) -> str:
-    user = users_coll.find_one({"user_id": user_id})
-    return user.get("language", "en") if user else "en"
-
-# Flask dashboard
-@flask_app.route("/dashboard")
-def dashboard():
-    stats = bot_stats_coll.find_one({"_id": 1}) or {}
-    top_players = scores_coll.find().sort("global.all_time", -1).limit(5)
-    return render_template(
-        "dashboard.html",
-        games_started=stats.get("games_started", 0),
-        guesses_made=stats.get("guesses_made", 0),
-        top_players=[{"name": app.get_users(p["user_id"]).first_name, "score": p["global"]["all_time"]} for p in top_players]
-    )
+async def get_user_language(user_id: int) -> str:
+    if user_id in _lang_cache:
+        return _lang_cache[user_id]
+    user = await users_coll.find_one({"user_id": user_id}, {"language": 1})
+    _lang_cache[user_id] = user.get("language", "en") if user else "en"
+    return _lang_cache[user_id]
 
 # Command handlers
 @app.on_message(filters.command("new"))
+@per_chat
+@with_lang
 async def new_game(client: Client, message: Message):
     chat_id = message.chat.id
-    user_id = message.from_user.id
-    lang = get_user_language(user_id)
+    lang = message.lang
     args = message.command[1:]
     mode = args[0] if args else "standard"
     
@@ -268,69 +543,56 @@ async def new_game(client: Client, message: Message):
         await message.reply("Invalid mode! Use: standard, team, competitive")
         return
     
-    if games_coll.find_one({"chat_id": chat_id}):
-        await message.reply(LANGUAGES[lang]["game_in_progress"])
+    if await games_coll.find_one({"chat_id": chat_id}):
+        await message.reply(MESSAGES[lang]["game_in_progress"]())
         return
     
     settings = DEFAULT_SETTINGS.copy()
     settings["mode"] = mode
-    word = random.choice(fetch_words(settings["word_length"]))
+    word = random.choice(await get_words(settings["word_length"]))
+    started = datetime.now(timezone.utc)
     game = {
         "chat_id": chat_id,
         "word": word,
         "guesses": [],
-        "players": set(),
-        "teams": {"team1": set(), "team2": set()} if mode == "team" else {},
+        "guess_count": 0,
+        "players": [],
+        "teams": {"team1": [], "team2": []} if mode == "team" else {},
         "start_time": time.time(),
+        "remind_at": started + timedelta(seconds=settings["timeout"] / 2),
+        "expire_at": started + timedelta(seconds=settings["timeout"]),
+        "lang": lang,
         "settings": settings,
-        "banned": set()
+        "banned": []
     }
-    games_coll.insert_one(game)
-    bot_stats_coll.update_one({"_id": 1}, {"$inc": {"games_started": 1}}, upsert=True)
-    
-    await message.reply(LANGUAGES[lang]["new_game"].format(length=settings["word_length"]))
+    await games_coll.insert_one(game)
+    await bot_stats_coll.update_one({"_id": 1}, {"$inc": {"games_started": 1}}, upsert=True)
     
-    # Schedule timeout and reminders
-    async def game_tasks():
-        await asyncio.sleep(settings["timeout"] / 2)
-        game = games_coll.find_one({"chat_id": chat_id})
-        if game:
-            guesses_left = settings["max_guesses"] - len(game["guesses"])
-            await client.send_message(chat_id, LANGUAGES[lang]["reminder"].format(left=guesses_left))
-        
-        await asyncio.sleep(settings["timeout"] / 2)
-        game = games_coll.find_one({"chat_id": chat_id})
-        if game:
-            games_coll.delete_one({"chat_id": chat_id})
-            await client.send_message(chat_id, LANGUAGES[lang]["game_ended"].format(word=game["word"]))
-    
-    asyncio.create_task(game_tasks())
+    await message.reply(MESSAGES[lang]["new_game"](length=settings["word_length"]))
 
 @app.on_message(filters.command("end") & filters.group)
+@per_chat
+@with_lang
+@requires_admin
 async def end_game(client: Client, message: Message):
     chat_id = message.chat.id
-    user_id = message.from_user.id
-    lang = get_user_language(user_id)
-    if not is_admin(chat_id, user_id, message):
-        await message.reply(LANGUAGES[lang]["admin_only"])
-        return
+    lang = message.lang
     
-    game = games_coll.find_one({"chat_id": chat_id})
+    game = await games_coll.find_one({"chat_id": chat_id})
     if not game:
-        await message.reply(LANGUAGES[lang]["no_game"])
+        await message.reply(MESSAGES[lang]["no_game"]())
         return
     
-    games_coll.delete_one({"chat_id": chat_id})
-    await message.reply(LANGUAGES[lang]["game_ended"].format(word=game["word"]))
+    await games_coll.delete_one({"chat_id": chat_id})
+    await message.reply(MESSAGES[lang]["game_ended"](word=game["word"]))
 
 @app.on_message(filters.command("settings") & filters.group)
+@per_chat
+@with_lang
+@requires_admin
 async def update_settings(client: Client, message: Message):
     chat_id = message.chat.id
-    user_id = message.from_user.id
-    lang = get_user_language(user_id)
-    if not is_admin(chat_id, user_id, message):
-        await message.reply(LANGUAGES[lang]["admin_only"])
-        return
+    lang = message.lang
     
     args = message.command[1:]
     if len(args) != 2:
@@ -349,20 +611,19 @@ async def update_settings(client: Client, message: Message):
         await message.reply("Invalid setting or value!")
         return
     
-    game = games_coll.find_one({"chat_id": chat_id})
+    game = await games_coll.find_one({"chat_id": chat_id})
     settings = game["settings"] if game else DEFAULT_SETTINGS.copy()
     settings[key] = value
-    games_coll.update_one({"chat_id": chat_id}, {"$set": {"settings": settings}}, upsert=True)
-    await message.reply(LANGUAGES[lang]["settings_updated"].format(settings=settings))
+    await games_coll.update_one({"chat_id": chat_id}, {"$set": {"settings": settings}}, upsert=True)
+    await message.reply(MESSAGES[lang]["settings_updated"](settings=settings))
 
 @app.on_message(filters.command("ban") & filters.group)
+@per_chat
+@with_lang
+@requires_admin
 async def ban_user(client: Client, message: Message):
     chat_id = message.chat.id
-    user_id = message.from_user.id
-    lang = get_user_language(user_id)
-    if not is_admin(chat_id, user_id, message):
-        await message.reply(LANGUAGES[lang]["admin_only"])
-        return
+    lang = message.lang
     
     args = message.command[1:]
     if not args:
@@ -372,20 +633,19 @@ async def ban_user(client: Client, message: Message):
     try:
         target_id = int(args[0])
         user = await client.get_users(target_id)
-        games_coll.update_one({"chat_id": chat_id}, {"$addToSet": {"banned": target_id}})
-        await message.reply(LANGUAGES[lang]["banned"].format(name=user.first_name))
+        await games_coll.update_one({"chat_id": chat_id}, {"$addToSet": {"banned": target_id}})
+        await message.reply(MESSAGES[lang]["banned"](name=user.first_name))
     except Exception as e:
         await message.reply("Invalid user ID!")
-        logger.error(f"Error banning user: {e}")
+        logger.error("Error banning user: %s", e)
 
 @app.on_message(filters.command("kick") & filters.group)
+@per_chat
+@with_lang
+@requires_admin
 async def kick_user(client: Client, message: Message):
     chat_id = message.chat.id
-    user_id = message.from_user.id
-    lang = get_user_language(user_id)
-    if not is_admin(chat_id, user_id, message):
-        await message.reply(LANGUAGES[lang]["admin_only"])
-        return
+    lang = message.lang
     
     args = message.command[1:]
     if not args:
@@ -395,20 +655,17 @@ async def kick_user(client: Client, message: Message):
     try:
         target_id = int(args[0])
         user = await client.get_users(target_id)
-        game = games_coll.find_one({"chat_id": chat_id})
-        if game:
-            game["players"].discard(target_id)
-            games_coll.update_one({"chat_id": chat_id}, {"$set": {"players": game["players"]}})
-        await message.reply(LANGUAGES[lang]["kicked"].format(name=user.first_name))
+        await games_coll.update_one({"chat_id": chat_id}, {"$pull": {"players": target_id}})
+        await message.reply(MESSAGES[lang]["kicked"](name=user.first_name))
     except Exception as e:
         await message.reply("Invalid user ID!")
-        logger.error(f"Error kicking user: {e}")
+        logger.error("Error kicking user: %s", e)
 
 @app.on_message(filters.command("achievements"))
+@per_chat
 async def achievements_command(client: Client, message: Message):
     user_id = message.from_user.id
-    lang = get_user_language(user_id)
-    user_stats = stats_coll.find_one({"user_id": user_id}) or {}
+    user_stats = await stats_coll.find_one({"user_id": user_id}) or {}
     achievements = user_stats.get("achievements", [])
     text = "Your Achievements:\n"
     for ach_id in achievements:
@@ -416,15 +673,19 @@ async def achievements_command(client: Client, message: Message):
     await message.reply(text or "No achievements yet!")
 
 @app.on_message(filters.command("help"))
+@per_chat
+@with_lang
 async def help_command(client: Client, message: Message):
-    lang = get_user_language(message.from_user.id)
+    lang = message.lang
     settings = DEFAULT_SETTINGS
-    await message.reply(LANGUAGES[lang]["help"].format(length=settings["word_length"], max_guesses=settings["max_guesses"]))
+    await message.reply(MESSAGES[lang]["help"](length=settings["word_length"], max_guesses=settings["max_guesses"]))
 
 @app.on_message(filters.command("leaderboard"))
+@per_chat
+@with_lang
 async def leaderboard_command(client: Client, message: Message):
     chat_id = message.chat.id
-    lang = get_user_language(message.from_user.id)
+    lang = message.lang
     args = message.command[1:]
     scope = args[0] if len(args) > 0 else "scores"
     period = args[1] if len(args) > 1 else "all_time"
@@ -433,14 +694,16 @@ async def leaderboard_command(client: Client, message: Message):
         await message.reply("Usage: /leaderboard [global/group] [today/week/month/all]")
         return
     
-    result, keyboard = get_leaderboard("scores" if scope == "group" else "global", chat_id, period)
-    await message.reply(LANGUAGES[lang]["leaderboard"].format(scope=scope, period=period, data=result), reply_markup=keyboard)
+    result, keyboard = await get_leaderboard("scores" if scope == "group" else "global", chat_id, period)
+    await message.reply(MESSAGES[lang]["leaderboard"](scope=scope, period=period, data=result), reply_markup=keyboard)
 
 @app.on_message(filters.command("myscore"))
+@per_chat
+@with_lang
 async def myscore_command(client: Client, message: Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
-    lang = get_user_language(user_id)
+    lang = message.lang
     args = message.command[1:]
     scope = args[0] if len(args) > 0 else "group"
     period = args[1] if len(args) > 1 else "all_time"
@@ -449,36 +712,40 @@ async def myscore_command(client: Client, message: Message):
         await message.reply("Usage: /myscore [global/group] [today/week/month/all]")
         return
     
-    user = scores_coll.find_one({"user_id": user_id})
+    match = {"user_id": user_id, "date": None if period == "all_time" else {"$gte": period_starts()[period]}}
+    if scope == "group":
+        match["chat_id"] = chat_id
     score = 0
-    if user:
-        if scope == "group" and str(chat_id) in user.get("scores", {}):
-            score = user["scores"][str(chat_id)].get(period, 0)
-        elif scope == "global":
-            score = user["global"].get(period, 0)
+    async for total in scores_coll.aggregate([
+        {"$match": match},
+        {"$group": {"_id": None, "score": {"$sum": "$wins"}}}
+    ]):
+        score = total["score"]
     
-    await message.reply(LANGUAGES[lang]["myscore"].format(scope=scope, period=period, score=score))
+    await message.reply(MESSAGES[lang]["myscore"](scope=scope, period=period, score=score))
 
 @app.on_message(filters.command("stats") & filters.private)
+@per_chat
+@with_lang
 async def stats_command(client: Client, message: Message):
     user_id = message.from_user.id
-    lang = get_user_language(user_id)
+    lang = message.lang
     admin_ids = [123456789]  # Replace with actual admin IDs
     if user_id not in admin_ids:
-        await message.reply(LANGUAGES[lang]["admin_only"])
+        await message.reply(MESSAGES[lang]["admin_only"]())
         return
     
-    stats = bot_stats_coll.find_one({"_id": 1}) or {}
-    await message.reply(LANGUAGES[lang]["stats"].format(
+    stats = await bot_stats_coll.find_one({"_id": 1}) or {}
+    await message.reply(MESSAGES[lang]["stats"](
         games=stats.get("games_started", 0),
         guesses=stats.get("guesses_made", 0)
     ))
 
 @app.on_message(filters.command("profile"))
+@per_chat
 async def profile_command(client: Client, message: Message):
     user_id = message.from_user.id
-    lang = get_user_language(user_id)
-    user_stats = stats_coll.find_one({"user_id": user_id}) or {}
+    user_stats = await stats_coll.find_one({"user_id": user_id}) or {}
     games_played = user_stats.get("games_played", 0)
     wins = user_stats.get("wins", 0)
     total_guesses = user_stats.get("total_guesses", 0)
@@ -493,113 +760,220 @@ async def profile_command(client: Client, message: Message):
     await message.reply(profile_text)
 
 @app.on_message(filters.command("language"))
+@per_chat
 async def language_command(client: Client, message: Message):
     user_id = message.from_user.id
     args = message.command[1:]
     if not args or args[0] not in LANGUAGES:
         await message.reply(f"Available languages: {', '.join(LANGUAGES.keys())}")
         return
-    users_coll.update_one({"user_id": user_id}, {"$set": {"language": args[0]}}, upsert=True)
+    await users_coll.update_one({"user_id": user_id}, {"$set": {"language": args[0]}}, upsert=True)
+    _lang_cache.pop(user_id, None)
     await message.reply(f"Language set to {args[0]}")
 
-@app.on_callback_query(filters.regex(r"leaderboard_(\w+)_(\w+)_(\d+)"))
-async def leaderboard_pagination(client: Client, callback_query):
-    scope, period, page = callback_query.data.split("_")[1:]
+# Leaderboard pagination callbacks are "lb:<scope>:<period>:<page>"
+# Async on purpose: pyrogram runs sync filters through run_in_executor
+async def is_leaderboard_callback(_, __, query) -> bool:
+    return (query.data or "").startswith("lb:")
+
+leaderboard_callback = filters.create(is_leaderboard_callback)
+
+@app.on_callback_query(leaderboard_callback)
+@per_chat
+@with_lang
+async def leaderboard_pagination(client: Client, callback_query: CallbackQuery):
+    _, scope, period, page = callback_query.data.split(":")
     page = int(page)
     chat_id = callback_query.message.chat.id
-    lang = get_user_language(callback_query.from_user.id)
-    result, keyboard = get_leaderboard(scope, chat_id, period, page)
+    lang = callback_query.lang
+    result, keyboard = await get_leaderboard(scope, chat_id, period, page)
     await callback_query.message.edit_text(
-        LANGUAGES[lang]["leaderboard"].format(scope=scope, period=period, data=result),
+        MESSAGES[lang]["leaderboard"](scope=scope, period=period, data=result),
         reply_markup=keyboard
     )
 
 # Handle guesses
 @app.on_message(filters.text & ~filters.command)
+@per_chat
+@with_lang
 async def handle_guess(client: Client, message: Message):
     chat_id = message.chat.id
     user_id = message.from_user.id
-    lang = get_user_language(user_id)
+    lang = message.lang
     guess = message.text.lower().strip()
     
     # Rate limiting
     now = time.time()
     if redis_client:
-        key = f"guess:{user_id}"
-        if redis_client.get(key):
+        # Atomic check-and-set: only succeeds if no guess was made within RATE_LIMIT
+        if not await redis_client.set(f"guess:{user_id}", 1, ex=RATE_LIMIT, nx=True):
             await message.reply("Slow down! Wait a moment before guessing again.")
             return
-        redis_client.setex(key, RATE_LIMIT, 1)
     else:
         if user_id in user_last_guess and now - user_last_guess[user_id] < RATE_LIMIT:
             await message.reply("Slow down! Wait a moment before guessing again.")
             return
         user_last_guess[user_id] = now
     
-    game = games_coll.find_one({"chat_id": chat_id})
-    if not game:
-        return
+    # Record the guess in one round-trip; the filter only matches when the guess is acceptable
+    game_filter = {"chat_id": chat_id, "banned": {"$ne": user_id}, "settings.word_length": len(guess)}
+    guess_update = {
+        "$push": {"guesses": {"$each": [[user_id, guess]], "$slice": -GUESS_HISTORY_LIMIT}},
+        "$inc": {"guess_count": 1},
+        "$addToSet": {"players": user_id}
+    }
+    projection = {"word": 1, "settings": 1, "guess_count": 1}
+    game = None
+    if guess.isalpha() and guess in _WORD_SETS.get(len(guess), ()):
+        game = await games_coll.find_one_and_update(
+            game_filter, guess_update, projection=projection, return_document=ReturnDocument.AFTER
+        )
     
-    if user_id in game.get("banned", set()):
-        await message.reply("You are banned from this game!")
-        return
+    if not game:
+        # Slow path: find out why the guess was not recorded
+        game = await games_coll.find_one({"chat_id": chat_id}, {"banned": 1, "settings": 1})
+        if not game:
+            return
+        
+        if user_id in game.get("banned", []):
+            await message.reply("You are banned from this game!")
+            return
+        
+        settings = game["settings"]
+        if len(guess) != settings["word_length"] or not guess.isalpha():
+            await message.reply(MESSAGES[lang]["invalid_guess"](length=settings["word_length"]))
+            return
+        
+        if guess not in await get_word_set(settings["word_length"]):
+            await message.reply(MESSAGES[lang]["not_valid_word"]())
+            return
+        
+        game = await games_coll.find_one_and_update(
+            game_filter, guess_update, projection=projection, return_document=ReturnDocument.AFTER
+        )
+        if not game:
+            return
     
     settings = game["settings"]
-    if len(guess) != settings["word_length"] or not guess.isalpha():
-        await message.reply(LANGUAGES[lang]["invalid_guess"].format(length=settings["word_length"]))
-        return
-    
-    if guess not in WORDS:
-        await message.reply(LANGUAGES[lang]["not_valid_word"])
-        return
-    
     team = None
     if settings["mode"] == "team":
-        team = "team1" if len(game["guesses"]) % 2 == 0 else "team2"
-        game["teams"][team].add(user_id)
+        team = "team1" if (game["guess_count"] - 1) % 2 == 0 else "team2"
+        await games_coll.update_one({"chat_id": chat_id}, {"$addToSet": {f"teams.{team}": user_id}})
     
-    game["guesses"].append((user_id, guess))
-    game["players"].add(user_id)
-    games_coll.update_one(
-        {"chat_id": chat_id},
-        {"$set": {"guesses": game["guesses"], "players": game["players"], "teams": game["teams"]}}
-    )
-    update_stats(user_id, 1)
+    won = guess == game["word"]
+    await update_stats(user_id, 1, wins=int(won))
     
     hint = get_hint(guess, game["word"])
-    if guess == game["word"]:
-        update_score(user_id, chat_id, settings["mode"], team)
-        unlocked = check_achievements(user_id)
-        games_coll.delete_one({"chat_id": chat_id})
-        user = await client.get_users(user_id)
-        reply = LANGUAGES[lang]["win"].format(name=user.first_name, word=game["word"])
+    if won:
+        await update_score(user_id, chat_id, message.from_user.first_name, settings["mode"], team)
+        unlocked = await check_achievements(user_id)
+        await games_coll.delete_one({"chat_id": chat_id})
+        reply = MESSAGES[lang]["win"](name=message.from_user.first_name, word=game["word"])
         if unlocked:
-            reply += "\n" + LANGUAGES[lang]["achievement"].format(name=", ".join(unlocked))
+            reply += "\n" + MESSAGES[lang]["achievement"](name=", ".join(unlocked))
         await message.reply(reply)
         return
     
-    if len(game["guesses"]) >= settings["max_guesses"]:
-        games_coll.delete_one({"chat_id": chat_id})
-        await message.reply(LANGUAGES[lang]["game_over"].format(word=game["word"]))
+    if game["guess_count"] >= settings["max_guesses"]:
+        await games_coll.delete_one({"chat_id": chat_id})
+        await message.reply(MESSAGES[lang]["game_over"](word=game["word"]))
         return
     
-    await message.reply(LANGUAGES[lang]["guesses_left"].format(
+    await message.reply(MESSAGES[lang]["guesses_left"](
         guess=guess,
         hint=hint,
-        left=settings["max_guesses"] - len(game["guesses"])
+        left=settings["max_guesses"] - game["guess_count"]
     ))
 
-# Start Flask dashboard in a separate thread
-def run_flask():
-    flask_app.run(host="0.0.0.0", port=5000)
+# Game reminders and timeouts, handled by one shared task instead of one task per game
+GAME_REAPER_INTERVAL = 30  # seconds
+GAME_TTL_GRACE = 3600  # seconds; Mongo drops games the reaper missed, e.g. while the bot was down
+
+async def reap_games():
+    now = datetime.now(timezone.utc)
+    reminded = []
+    async for game in games_coll.find(
+        {"remind_at": {"$lte": now}, "reminder_sent": {"$ne": True}},
+        {"chat_id": 1, "lang": 1, "guess_count": 1, "settings": 1}
+    ):
+        reminded.append(UpdateOne({"_id": game["_id"]}, {"$set": {"reminder_sent": True}}))
+        guesses_left = game["settings"]["max_guesses"] - game.get("guess_count", 0)
+        try:
+            await app.send_message(game["chat_id"], MESSAGES[game.get("lang", "en")]["reminder"](left=guesses_left))
+        except Exception as e:
+            logger.error("Error sending reminder to chat %s: %s", game['chat_id'], e)
+    if reminded:
+        await games_coll.bulk_write(reminded, ordered=False)
+    
+    expired = []
+    async for game in games_coll.find({"expire_at": {"$lte": now}}, {"chat_id": 1, "lang": 1, "word": 1}):
+        expired.append(game["_id"])
+        try:
+            await app.send_message(game["chat_id"], MESSAGES[game.get("lang", "en")]["game_ended"](word=game["word"]))
+        except Exception as e:
+            logger.error("Error ending game in chat %s: %s", game['chat_id'], e)
+    if expired:
+        await games_coll.delete_many({"_id": {"$in": expired}})
+
+async def _reap_games_loop():
+    while True:
+        try:
+            await reap_games()
+        except Exception as e:
+            logger.error("Error reaping games: %s", e)
+        await asyncio.sleep(GAME_REAPER_INTERVAL)
+
+async def migrate_legacy_scores():
+    # Pre-bucket score docs had no chat_id and kept counters under scores.<chat_id>.*; fold their
+    # all-time wins into the date=None buckets. Their today/week/month counters never reset, so they are dropped.
+    async for doc in scores_coll.find({"chat_id": {"$exists": False}}):
+        ops = [
+            UpdateOne({"user_id": doc["user_id"], "chat_id": int(chat_id), "date": None},
+                      {"$inc": {"wins": counters["all_time"]}}, upsert=True)
+            for chat_id, counters in doc.get("scores", {}).items() if counters.get("all_time")
+        ]
+        if ops:
+            await scores_coll.bulk_write(ops, ordered=False)
+        await scores_coll.delete_one({"_id": doc["_id"]})
+
+async def init_db():
+    await migrate_legacy_scores()
+    await games_coll.create_index("chat_id", unique=True)
+    await games_coll.create_index("expire_at", expireAfterSeconds=GAME_TTL_GRACE)
+    await scores_coll.create_index([("user_id", 1), ("chat_id", 1), ("date", -1)], unique=True)
+    # TTL indexes must be single-field; all-time buckets have date=None and never expire
+    await scores_coll.create_index("date", expireAfterSeconds=SCORE_RETENTION_DAYS * 86400)
+    await stats_coll.create_index("user_id", unique=True)
+    await users_coll.create_index("user_id", unique=True)
+    # $merge on these fields requires a unique index
+    await leaderboard_mv.create_index([("scope", 1), ("chat_id", 1), ("period", 1), ("user_id", 1)], unique=True)
+    await leaderboard_mv.create_index([("scope", 1), ("chat_id", 1), ("period", 1), ("score", -1)])
+
+async def on_startup():
+    global http_session
+    http_session = create_http_session()
+    await init_db()
+    spawn(_refresh_leaderboards_loop())
+    spawn(_reap_games_loop())
+
+async def on_shutdown():
+    if http_session:
+        await http_session.close()
+
+async def main():
+    await on_startup()
+    try:
+        await app.start()
+        print("Bot is running...")
+        await idle()
+        await app.stop()
+    finally:
+        await on_shutdown()
 
 if __name__ == "__main__":
-    import threading
-    threading.Thread(target=run_flask, daemon=True).start()
-    print("Bot is running...")
     try:
-        app.run()
+        app.run(main())
     except FloodWait as e:
-        logger.warning(f"FloodWait: Sleeping for {e.x} seconds")
+        logger.warning("FloodWait: Sleeping for %s seconds", e.x)
         time.sleep(e.x)
-        app.run()
+        app.run(main())
@@ -0,0 +1,64 @@
+import logging
+import configparser
+from pymongo import MongoClient
+from flask import Flask, render_template
+from flask_caching import Cache
+import flask_monitoringdashboard as fmd
+
+# Analytics dashboard for the WordSeek bot, served separately from the bot process:
+#   gunicorn -w 4 -b 0.0.0.0:5000 dashboard:flask_app
+# Several gunicorn instances can sit behind an NGINX upstream; they only share Mongo and Redis.
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Load configuration
+config = configparser.ConfigParser()
+config.read("config.ini")
+mongo_uri = config["Database"]["mongo_uri"]
+redis_host = config["Redis"]["host"]
+redis_port = config["Redis"]["port"]
+monitoring = config["Monitoring"] if config.has_section("Monitoring") else {}
+
+# MongoDB setup (same database as the bot)
+mongo_client = MongoClient(mongo_uri)
+db = mongo_client["wordseek"]
+bot_stats_coll = db["bot_stats"]
+leaderboard_mv = db["leaderboard_mv"]
+
+# Flask setup
+flask_app = Flask(__name__)
+cache = Cache(flask_app, config={
+    "CACHE_TYPE": "RedisCache",
+    "CACHE_REDIS_HOST": redis_host,
+    "CACHE_REDIS_PORT": int(redis_port),
+    "CACHE_DEFAULT_TIMEOUT": 60
+})
+
+# Endpoint latency and outlier monitoring at /fmd, stored in its own SQLite file rather than Mongo.
+# Only enabled with explicit credentials, never the library's admin/admin default.
+if monitoring.get("username") and monitoring.get("password"):
+    fmd.config.link = "fmd"
+    fmd.config.database_name = monitoring.get("database", "sqlite:///flask_monitoringdashboard.db")
+    fmd.config.username = monitoring["username"]
+    fmd.config.password = monitoring["password"]
+    fmd.bind(flask_app)
+else:
+    logger.warning("No [Monitoring] username/password in config.ini, /fmd monitoring is disabled")
+
+@flask_app.route("/dashboard")
+@cache.cached(timeout=60)
+def dashboard():
+    stats = bot_stats_coll.find_one({"_id": 1}) or {}
+    # Names are denormalized on score docs by the bot, so no Telegram calls are needed here
+    top_players = leaderboard_mv.find({"scope": "global", "chat_id": 0, "period": "all_time"}).sort("score", -1).limit(5)
+    return render_template(
+        "dashboard.html",
+        games_started=stats.get("games_started", 0),
+        guesses_made=stats.get("guesses_made", 0),
+        top_players=[{"name": p.get("first_name") or str(p["user_id"]), "score": p["score"]} for p in top_players]
+    )
+
+if __name__ == "__main__":
+    flask_app.run(host="0.0.0.0", port=5000)
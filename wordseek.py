@@ -1,56 +1,117 @@
+import ast
+import functools
+import heapq
+import json
+import os
 import random
 import time
-import sqlite3
+import aiosqlite
 import logging
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict, Set, List, Tuple
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.enums import ChatType
+from datetime import datetime, timezone
+from typing import Callable, Dict, Set, List, Tuple
+from pyrogram import Client, filters, idle
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.enums import ChatType, ChatMemberStatus
 import configparser
+from collections import ChainMap
+from string import Formatter
+from dataclasses import dataclass, field
 from pathlib import Path
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# The format above never prints thread or process info, so skip collecting it per record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 logger = logging.getLogger(__name__)
 
-# Load configuration
-config = configparser.ConfigParser()
-config.read("config.ini")
-api_id = config["Pyrogram"]["api_id"]
-api_hash = config["Pyrogram"]["api_hash"]
-bot_token = config["Pyrogram"]["bot_token"]
+# Load configuration: environment variables first, config.ini only for whatever is missing
+api_id = os.environ.get("PYROGRAM_API_ID")
+api_hash = os.environ.get("PYROGRAM_API_HASH")
+bot_token = os.environ.get("PYROGRAM_BOT_TOKEN")
+if not (api_id and api_hash and bot_token):
+    config = configparser.ConfigParser()
+    config.read("config.ini")
+    api_id = api_id or config["Pyrogram"]["api_id"]
+    api_hash = api_hash or config["Pyrogram"]["api_hash"]
+    bot_token = bot_token or config["Pyrogram"]["bot_token"]
+    del config
+
+# Use uvloop where available (not on Windows). It must be installed before the Client is
+# created, because pyrogram binds the current event loop in Client.__init__.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 
 # Initialize Pyrogram client
 app = Client("WordSeekBot", api_id=api_id, api_hash=api_hash, bot_token=bot_token)
 
-# Database setup
-def init_db():
-    conn = sqlite3.connect("wordseek.db")
-    c = conn.cursor()
-    c.execute("""
+# Database setup: one long-lived connection, opened in on_startup
+DB: aiosqlite.Connection = None
+
+# Wins are kept per (user_id, chat_id, period_key) bucket, one bucket per period:
+# "2025-01-15" (today), "2025-W03" (ISO week), "2025-01" (month) and "all" (all_time)
+PERIODS = ("today", "week", "month", "all_time")
+SCORE_PRUNE_INTERVAL = 3600  # seconds
+
+def period_keys(now: datetime = None) -> Dict[str, str]:
+    now = now or datetime.now(timezone.utc)
+    year, week, _ = now.isocalendar()
+    return {
+        "today": now.strftime("%Y-%m-%d"),
+        "week": f"{year}-W{week:02d}",
+        "month": now.strftime("%Y-%m"),
+        "all_time": "all",
+    }
+
+async def init_db():
+    global DB
+    DB = await aiosqlite.connect("wordseek.db")
+    await DB.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-64000;
+    """)
+    await DB.execute("""
         CREATE TABLE IF NOT EXISTS games (
             chat_id INTEGER PRIMARY KEY,
             word TEXT,
-            guesses TEXT,
-            players TEXT,
             start_time REAL,
             settings TEXT
         )
     """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS scores (
+    await DB.execute("""
+        CREATE TABLE IF NOT EXISTS game_guesses (
+            chat_id INTEGER,
+            seq INTEGER,
+            user_id INTEGER,
+            guess TEXT,
+            ts REAL,
+            PRIMARY KEY (chat_id, seq)
+        )
+    """)
+    await DB.execute("""
+        CREATE TABLE IF NOT EXISTS game_players (
+            chat_id INTEGER,
+            user_id INTEGER,
+            PRIMARY KEY (chat_id, user_id)
+        )
+    """)
+    await DB.execute("""
+        CREATE TABLE IF NOT EXISTS score_buckets (
             user_id INTEGER,
             chat_id INTEGER,
-            today INTEGER DEFAULT 0,
-            week INTEGER DEFAULT 0,
-            month INTEGER DEFAULT 0,
-            all_time INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, chat_id)
+            period_key TEXT,
+            wins INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, chat_id, period_key)
         )
     """)
-    c.execute("""
+    await DB.execute("""
         CREATE TABLE IF NOT EXISTS stats (
             user_id INTEGER PRIMARY KEY,
             games_played INTEGER DEFAULT 0,
@@ -58,7 +119,7 @@ def init_db():
             total_guesses INTEGER DEFAULT 0
         )
     """)
-    c.execute("""
+    await DB.execute("""
         CREATE TABLE IF NOT EXISTS bot_stats (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             games_started INTEGER DEFAULT 0,
@@ -66,24 +127,55 @@ def init_db():
             last_updated REAL
         )
     """)
-    c.execute("INSERT OR IGNORE INTO bot_stats (id, games_started, guesses_made, last_updated) VALUES (1, 0, 0, ?)", (time.time(),))
-    conn.commit()
-    conn.close()
+    # Group leaderboards walk the first index in order; global ones aggregate one bucket via the second
+    await DB.execute("CREATE INDEX IF NOT EXISTS idx_score_buckets_chat ON score_buckets(period_key, chat_id, wins DESC)")
+    await DB.execute("CREATE INDEX IF NOT EXISTS idx_score_buckets_user ON score_buckets(period_key, user_id, wins)")
+    # The old per-column scores table never reset today/week/month; only all_time is carried over
+    if await fetch_one("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scores'"):
+        await DB.execute("""
+            INSERT OR IGNORE INTO score_buckets (user_id, chat_id, period_key, wins)
+            SELECT user_id, chat_id, 'all', all_time FROM scores WHERE all_time > 0
+        """)
+        await DB.execute("DROP TABLE scores")
+    await DB.execute("INSERT OR IGNORE INTO bot_stats (id, games_started, guesses_made, last_updated) VALUES (1, 0, 0, ?)", (time.time(),))
+    await migrate_legacy_settings()
+    await DB.commit()
 
-init_db()
+async def migrate_legacy_settings():
+    # Games started before settings were stored as JSON hold str(dict); rewrite them once as JSON
+    # and drop rows that can't be parsed, so load_active_games never sees them
+    async with DB.execute("SELECT chat_id, settings FROM games") as cursor:
+        rows = await cursor.fetchall()
+    for chat_id, settings in rows:
+        try:
+            json.loads(settings)
+            continue
+        except (TypeError, ValueError):
+            pass
+        try:
+            parsed = ast.literal_eval(settings)
+            if not isinstance(parsed, dict):
+                raise ValueError(f"not a dict: {parsed!r}")
+        except (TypeError, ValueError, SyntaxError) as e:
+            logger.warning("Dropping game in chat %s with unreadable settings: %s", chat_id, e)
+            await delete_game(chat_id)
+            continue
+        await DB.execute("UPDATE games SET settings = ? WHERE chat_id = ?", (json.dumps({**DEFAULT_SETTINGS, **parsed}), chat_id))
 
-# Load word list
-WORDS = []
-def load_words():
+# Load word list: a frozenset for O(1) guess validation, a tuple for random.choice
+def load_words() -> frozenset:
     try:
+        # One read, one lower() and one split() over the whole file instead of per-line strip/lower
         with open("words.txt", "r") as f:
-            WORDS.extend([line.strip().lower() for line in f if len(line.strip()) == 5 and line.strip().isalpha()])
-        logger.info(f"Loaded {len(WORDS)} words")
+            words = frozenset(word for word in f.read().lower().split() if len(word) == 5 and word.isalpha())
+        logger.info("Loaded %s words", len(words))
     except FileNotFoundError:
-        WORDS.extend(["apple", "brave", "cloud", "dream", "eagle", "flame", "grape", "house", "jolly", "knife"])
+        words = frozenset(["apple", "brave", "cloud", "dream", "eagle", "flame", "grape", "house", "jolly", "knife"])
         logger.warning("words.txt not found, using default word list")
+    return words
 
-load_words()
+WORDS_SET = load_words()
+WORDS_TUPLE = tuple(WORDS_SET)
 
 # Localization
 LANGUAGES = {
@@ -109,8 +201,8 @@ LANGUAGES = {
 - /new: Start a new game.
 - /end: End the current game (group admins only).
 - /settings [max_guesses/length/timeout] [value]: Adjust game settings (admins only).
-- /leaderboard [global/group] [today/week/month/all]: View leaderboards.
-- /myscore [group/global] [today/week/month/all]: View your score.
+- /leaderboard [global/group] [today/week/month/all_time]: View leaderboards.
+- /myscore [group/global] [today/week/month/all_time]: View your score.
 - /stats: View bot usage stats (bot admins only).
 - /profile: View your game profile.
 - /language [en/es]: Set language.
@@ -145,8 +237,8 @@ LANGUAGES = {
 - /new: Iniciar un nuevo juego.
 - /end: Terminar el juego actual (solo administradores de grupo).
 - /settings [max_guesses/length/timeout] [value]: Ajustar configuraciones del juego (solo administradores).
-- /leaderboard [global/group] [today/week/month/all]: Ver tablas de clasificación.
-- /myscore [group/global] [today/week/month/all]: Ver tu puntuación.
+- /leaderboard [global/group] [today/week/month/all_time]: Ver tablas de clasificación.
+- /myscore [group/global] [today/week/month/all_time]: Ver tu puntuación.
 - /stats: Ver estadísticas de uso del bot (solo administradores del bot).
 - /profile: Ver tu perfil de juego.
 - /language [en/es]: Cambiar idioma.
@@ -161,6 +253,18 @@ LANGUAGES = {
     }
 }
 
+def compile_template(template: str) -> Callable[..., str]:
+    # Generate `lambda *, field, ...: f"<template>"` so the format string is parsed once, here
+    fields = sorted({name for _, name, _, _ in Formatter().parse(template) if name})
+    params = f"*, {', '.join(fields)}" if fields else ""
+    return eval(f"lambda {params}: f{template!r}")
+
+# Templates are trusted constants; missing translations fall back to English
+MESSAGES: Dict[str, Dict[str, Callable[..., str]]] = {
+    lang: {key: compile_template(template) for key, template in ChainMap(strings, LANGUAGES["en"]).items()}
+    for lang, strings in LANGUAGES.items()
+}
+
 # Game settings
 DEFAULT_SETTINGS = {
     "max_guesses": 30,
@@ -168,84 +272,304 @@ DEFAULT_SETTINGS = {
     "timeout": 3600  # 1 hour in seconds
 }
 
-# Rate limiting
+# Active games live in memory; SQLite only records them so they survive a restart
+@dataclass(slots=True)
+class GameState:
+    word: str
+    settings: dict
+    start_time: float
+    lang: str = "en"
+    guess_count: int = 0
+    players: Set[int] = field(default_factory=set)
+    last_guess: Dict[int, float] = field(default_factory=dict)  # user_id -> time.monotonic()
+
+ACTIVE_GAMES: Dict[int, GameState] = {}
+
+# Game timeouts: one heap of (expires_at, chat_id) drained by scheduler(). Entries are never
+# removed early; a game that already ended is simply skipped when its entry comes due.
+TIMEOUT_HEAP: List[Tuple[float, int]] = []
+SCHEDULER_MAX_SLEEP = 60  # seconds
+
+# Rate limiting, tracked per game in GameState.last_guess
 RATE_LIMIT = 2  # seconds between guesses
-user_last_guess: Dict[int, float] = {}
+
+# Admin status cache: (chat_id, user_id) -> (is_admin, expires_at)
+ADMIN_CACHE_TTL = 60  # seconds
+ADMIN_CACHE_MAX = 10_000
+ADMIN_CACHE: Dict[Tuple[int, int], Tuple[bool, float]] = {}
+
+# Display name cache for leaderboards: user_id -> (first_name, expires_at)
+USER_CACHE_TTL = 3600  # seconds
+USER_CACHE_FAIL_TTL = 300  # seconds an unresolvable id is shown by number before retrying
+USER_CACHE_MAX = 10_000
+USER_CACHE: Dict[int, Tuple[str, float]] = {}
+
+# Background tasks: the event loop only keeps weak references, so hold them until they finish
+TASKS: Set[asyncio.Task] = set()
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    TASKS.add(task)
+    task.add_done_callback(TASKS.discard)
+    return task
+
+# Updates are sharded over WORKER_COUNT queues by chat_id: one chat's updates always land on
+# the same worker and run in order, while a slow chat only holds up its own shard
+WORKER_COUNT = 8
+WORKER_QUEUE_SIZE = 1000
+WORKER_QUEUES: List[asyncio.Queue] = []
+
+async def worker(queue: asyncio.Queue):
+    while True:
+        handler, client, update = await queue.get()
+        try:
+            await handler(client, update)
+        except Exception as e:
+            logger.error("Error in %s: %s", handler.__name__, e)
+
+def start_workers():
+    for _ in range(WORKER_COUNT):
+        queue = asyncio.Queue(maxsize=WORKER_QUEUE_SIZE)
+        WORKER_QUEUES.append(queue)
+        spawn(worker(queue))
+
+def sharded(handler):
+    @functools.wraps(handler)
+    async def dispatch(client: Client, update):
+        chat_id = update.message.chat.id if isinstance(update, CallbackQuery) else update.chat.id
+        try:
+            WORKER_QUEUES[hash(chat_id) % WORKER_COUNT].put_nowait((handler, client, update))
+        except asyncio.QueueFull:
+            logger.warning("Dropping update for chat %s: queue full", chat_id)
+    return dispatch
 
 # Helper functions
-def get_db():
-    return sqlite3.connect("wordseek.db")
+async def fetch_one(query: str, params: tuple = ()):
+    async with DB.execute(query, params) as cursor:
+        return await cursor.fetchone()
+
+async def delete_game(chat_id: int):
+    # Under FLUSH_LOCK so a flush that already took this game's guesses can't re-insert them afterwards
+    async with FLUSH_LOCK:
+        PENDING_GUESSES.pop(chat_id, None)
+        await DB.execute("DELETE FROM games WHERE chat_id = ?", (chat_id,))
+        await DB.execute("DELETE FROM game_guesses WHERE chat_id = ?", (chat_id,))
+        await DB.execute("DELETE FROM game_players WHERE chat_id = ?", (chat_id,))
+
+async def load_active_games():
+    async with DB.execute("SELECT chat_id, word, start_time, settings FROM games") as cursor:
+        async for chat_id, word, start_time, settings in cursor:
+            ACTIVE_GAMES[chat_id] = GameState(word, json.loads(settings), start_time)
+    async with DB.execute("SELECT chat_id, COUNT(*) FROM game_guesses GROUP BY chat_id") as cursor:
+        async for chat_id, count in cursor:
+            if chat_id in ACTIVE_GAMES:
+                ACTIVE_GAMES[chat_id].guess_count = count
+    async with DB.execute("SELECT chat_id, user_id FROM game_players") as cursor:
+        async for chat_id, user_id in cursor:
+            if chat_id in ACTIVE_GAMES:
+                ACTIVE_GAMES[chat_id].players.add(user_id)
+    for chat_id, game in ACTIVE_GAMES.items():
+        schedule_timeout(chat_id, game)
+    logger.info("Restored %s active games", len(ACTIVE_GAMES))
 
-def is_admin(chat_id: int, user_id: int, message: Message) -> bool:
+def schedule_timeout(chat_id: int, game: GameState):
+    heapq.heappush(TIMEOUT_HEAP, (game.start_time + game.settings["timeout"], chat_id))
+
+async def expire_game(client: Client, expiry: Tuple[int, GameState]):
+    chat_id, game = expiry
+    # The game may have been won, ended or had its timeout raised while this sat in the queue
+    if ACTIVE_GAMES.get(chat_id) is not game:
+        return
+    expires_at = game.start_time + game.settings["timeout"]
+    if expires_at > time.time():
+        heapq.heappush(TIMEOUT_HEAP, (expires_at, chat_id))
+        return
+    del ACTIVE_GAMES[chat_id]
+    await delete_game(chat_id)
+    await DB.commit()
+    await client.send_message(chat_id, MESSAGES[game.lang]["game_ended"](word=game.word))
+
+async def scheduler():
+    while True:
+        now = time.time()
+        while TIMEOUT_HEAP and TIMEOUT_HEAP[0][0] <= now:
+            _, chat_id = heapq.heappop(TIMEOUT_HEAP)
+            game = ACTIVE_GAMES.get(chat_id)
+            if not game:
+                continue
+            # /settings may have extended the timeout, or the chat may be on a newer game
+            expires_at = game.start_time + game.settings["timeout"]
+            if expires_at > now:
+                heapq.heappush(TIMEOUT_HEAP, (expires_at, chat_id))
+                continue
+            # End it on the chat's own shard so it can't interleave with that chat's /new or guesses
+            await WORKER_QUEUES[hash(chat_id) % WORKER_COUNT].put((expire_game, app, (chat_id, game)))
+        delay = TIMEOUT_HEAP[0][0] - time.time() if TIMEOUT_HEAP else SCHEDULER_MAX_SLEEP
+        await asyncio.sleep(min(max(delay, 0), SCHEDULER_MAX_SLEEP))
+
+def cache_user_name(user_id: int, name: str, now: float, ttl: float = USER_CACHE_TTL):
+    if user_id not in USER_CACHE and len(USER_CACHE) >= USER_CACHE_MAX:
+        USER_CACHE.pop(next(iter(USER_CACHE)))
+    USER_CACHE[user_id] = (name, now + ttl)
+
+async def get_user_names(user_ids: List[int]) -> Dict[int, str]:
+    now = time.time()
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        cached = USER_CACHE.get(user_id)
+        if cached and now < cached[1]:
+            names[user_id] = cached[0]
+        else:
+            missing.append(user_id)
+    if missing:
+        # One batched users.getUsers call for every name not in the cache. It fails as a whole
+        # if any single id can't be resolved, so fall back to one call per id in that case.
+        try:
+            users = await app.get_users(missing)
+        except Exception as e:
+            logger.error("Error fetching users %s, retrying one by one: %s", missing, e)
+            users = []
+            for user_id in missing:
+                try:
+                    users.append(await app.get_users(user_id))
+                except Exception as e:
+                    logger.error("Error fetching user %s: %s", user_id, e)
+        for user in users:
+            names[user.id] = user.first_name
+            cache_user_name(user.id, user.first_name, now)
+        # Briefly remember ids that didn't resolve so every page view doesn't repeat the lookup
+        for user_id in missing:
+            if user_id not in names:
+                names[user_id] = str(user_id)
+                cache_user_name(user_id, names[user_id], now, USER_CACHE_FAIL_TTL)
+    return names
+
+async def is_admin(chat_id: int, user_id: int, message: Message) -> bool:
     if message.chat.type == ChatType.PRIVATE:
         return True
+    key = (chat_id, user_id)
+    now = time.time()
+    cached = ADMIN_CACHE.get(key)
+    if cached and now < cached[1]:
+        return cached[0]
     try:
-        member = app.get_chat_member(chat_id, user_id)
-        return member.status in ["administrator", "creator"]
+        member = await app.get_chat_member(chat_id, user_id)
     except Exception as e:
-        logger.error(f"Error checking admin status: {e}")
+        logger.error("Error checking admin status: %s", e)
         return False
+    result = member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+    if len(ADMIN_CACHE) >= ADMIN_CACHE_MAX:
+        ADMIN_CACHE.pop(next(iter(ADMIN_CACHE)))
+    ADMIN_CACHE[key] = (result, now + ADMIN_CACHE_TTL)
+    return result
+
+HINT_EMOJI = ("🟥", "🟨", "🟩")
 
 def get_hint(guess: str, target: str) -> str:
-    hint = []
-    target_list = list(target)
-    for i in range(len(guess)):
-        if guess[i] == target[i]:
-            hint.append("🟩")
-            target_list[i] = None
-        elif guess[i] in target_list:
-            hint.append("🟨")
-            target_list[target_list.index(guess[i])] = None
-        else:
-            hint.append("🟥")
-    return "".join(hint)
+    # Two passes: greens first, then yellows drawn from per-letter counts of the unmatched
+    # target letters. Counting in a dict works for any alphabet words.txt may contain.
+    marks = [2 if g == t else 0 for g, t in zip(guess, target)]
+    counts: Dict[str, int] = {}
+    for t, mark in zip(target, marks):
+        if not mark:
+            counts[t] = counts.get(t, 0) + 1
+    for i, g in enumerate(guess):
+        if not marks[i] and counts.get(g):
+            marks[i] = 1
+            counts[g] -= 1
+    return "".join([HINT_EMOJI[m] for m in marks])
+
+# Score and stats deltas are buffered here and written by flusher() in one transaction
+FLUSH_INTERVAL = 0.5  # seconds
+PENDING_SCORES: Dict[Tuple[int, int], int] = {}  # (user_id, chat_id) -> wins
+PENDING_STATS: Dict[int, List[int]] = {}  # user_id -> [games_played, wins, total_guesses]
+PENDING_BOT = [0, 0]  # [games_started, guesses_made]
+PENDING_GUESSES: Dict[int, List[Tuple[int, int, int, str, float]]] = {}  # chat_id -> game_guesses rows
+FLUSH_LOCK = asyncio.Lock()  # held for a whole flush, and by delete_game
 
 def update_score(user_id: int, chat_id: int):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO scores (user_id, chat_id) VALUES (?, ?)", (user_id, chat_id))
-    c.execute("""
-        UPDATE scores SET all_time = all_time + 1,
-                         today = today + CASE WHEN date('now') = date('now') THEN 1 ELSE 0 END,
-                         week = week + CASE WHEN strftime('%W', 'now') = strftime('%W', 'now') THEN 1 ELSE 0 END,
-                         month = month + CASE WHEN strftime('%m', 'now') = strftime('%m', 'now') THEN 1 ELSE 0 END
-        WHERE user_id = ? AND chat_id = ?
-    """, (user_id, chat_id))
-    c.execute("UPDATE stats SET wins = wins + 1 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    key = (user_id, chat_id)
+    PENDING_SCORES[key] = PENDING_SCORES.get(key, 0) + 1
+    PENDING_STATS.setdefault(user_id, [0, 0, 0])[1] += 1
 
 def update_stats(user_id: int, guesses: int):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO stats (user_id) VALUES (?)", (user_id,))
-    c.execute("UPDATE stats SET games_played = games_played + 1, total_guesses = total_guesses + ? WHERE user_id = ?", (guesses, user_id))
-    c.execute("UPDATE bot_stats SET guesses_made = guesses_made + ?, last_updated = ? WHERE id = 1", (guesses, time.time()))
-    conn.commit()
-    conn.close()
-
-def get_leaderboard(scope: str, chat_id: int, period: str, page: int = 1, per_page: int = 5) -> Tuple[str, InlineKeyboardMarkup]:
-    conn = get_db()
-    c = conn.cursor()
-    query = f"SELECT user_id, {period} FROM scores WHERE {period} > 0"
-    params = []
-    if scope == "group":
-        query += " AND chat_id = ?"
-        params.append(chat_id)
-    query += f" ORDER BY {period} DESC LIMIT ? OFFSET ?"
-    params.extend([per_page, (page - 1) * per_page])
+    pending = PENDING_STATS.setdefault(user_id, [0, 0, 0])
+    pending[0] += 1
+    pending[2] += guesses
+    PENDING_BOT[1] += guesses
+
+async def flush_pending():
+    global PENDING_SCORES, PENDING_STATS, PENDING_GUESSES
+    async with FLUSH_LOCK:
+        scores, PENDING_SCORES = PENDING_SCORES, {}
+        stats, PENDING_STATS = PENDING_STATS, {}
+        guesses, PENDING_GUESSES = PENDING_GUESSES, {}
+        games_started, guesses_made = PENDING_BOT
+        PENDING_BOT[:] = [0, 0]
     
-    c.execute(query, params)
-    rows = c.fetchall()
-    leaderboard = []
-    for user_id, score in rows:
+        if scores:
+            keys = period_keys().values()
+            await DB.executemany("""
+                INSERT INTO score_buckets (user_id, chat_id, period_key, wins) VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, chat_id, period_key) DO UPDATE SET wins = wins + excluded.wins
+            """, [(user_id, chat_id, key, n) for (user_id, chat_id), n in scores.items() for key in keys])
+        if stats:
+            await DB.executemany("INSERT OR IGNORE INTO stats (user_id) VALUES (?)", [(user_id,) for user_id in stats])
+            await DB.executemany(
+                "UPDATE stats SET games_played = games_played + ?, wins = wins + ?, total_guesses = total_guesses + ? WHERE user_id = ?",
+                [(played, wins, guesses, user_id) for user_id, (played, wins, guesses) in stats.items()]
+            )
+        if guesses:
+            rows = [row for chat_rows in guesses.values() for row in chat_rows]
+            await DB.executemany("INSERT OR IGNORE INTO game_guesses (chat_id, seq, user_id, guess, ts) VALUES (?, ?, ?, ?, ?)", rows)
+            await DB.executemany("INSERT OR IGNORE INTO game_players (chat_id, user_id) VALUES (?, ?)", [(row[0], row[2]) for row in rows])
+        if games_started or guesses_made:
+            await DB.execute("UPDATE bot_stats SET games_started = games_started + ?, guesses_made = guesses_made + ?, last_updated = ? WHERE id = 1",
+                             (games_started, guesses_made, time.time()))
+        if DB.in_transaction:
+            await DB.commit()
+
+async def flusher():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
         try:
-            user = app.get_users(user_id)
-            leaderboard.append((user.first_name, score))
+            await flush_pending()
         except Exception as e:
-            logger.error(f"Error fetching user {user_id}: {e}")
+            logger.error("Error flushing pending stats: %s", e)
+
+async def prune_scores():
+    # Keys sort as "YYYY-MM" < "YYYY-MM-DD" < "YYYY-Www" < "all", so everything below the
+    # current month key is a past day or month, or a week from an earlier year. In the first days
+    # of January the ISO week can still belong to last year ("2026-W53" < "2027-01"), so the
+    # cutoff is whichever of the two current keys sorts first.
+    while True:
+        try:
+            keys = period_keys()
+            await DB.execute("DELETE FROM score_buckets WHERE period_key < ?", (min(keys["month"], keys["week"]),))
+            await DB.commit()
+        except Exception as e:
+            logger.error("Error pruning score buckets: %s", e)
+        await asyncio.sleep(SCORE_PRUNE_INTERVAL)
+
+async def get_leaderboard(scope: str, chat_id: int, period: str, page: int = 1, per_page: int = 5) -> Tuple[str, InlineKeyboardMarkup]:
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    period_key = period_keys()[period]
+    if scope == "group":
+        query = "SELECT user_id, wins FROM score_buckets WHERE period_key = ? AND chat_id = ? AND wins > 0 ORDER BY wins DESC LIMIT ? OFFSET ?"
+        params = [period_key, chat_id]
+    else:
+        query = "SELECT user_id, SUM(wins) AS total FROM score_buckets WHERE period_key = ? GROUP BY user_id HAVING total > 0 ORDER BY total DESC LIMIT ? OFFSET ?"
+        params = [period_key]
+    params.extend([per_page, (page - 1) * per_page])
+    
+    async with DB.execute(query, params) as cursor:
+        rows = await cursor.fetchall()
+    names = await get_user_names([user_id for user_id, _ in rows])
+    leaderboard = [(names.get(user_id, str(user_id)), score) for user_id, score in rows]
     
-    total = len(leaderboard)
+    total = len(rows)
     result = f"{scope.capitalize()} Leaderboard ({period}):\n"
     for i, (name, score) in enumerate(leaderboard, 1 + (page - 1) * per_page):
         result += f"{i}. {name}: {score}\n"
@@ -261,7 +585,6 @@ def get_leaderboard(scope: str, chat_id: int, period: str, page: int = 1, per_pa
         buttons.append(InlineKeyboardButton("Next", callback_data=f"leaderboard_{scope}_{period}_{page+1}"))
     keyboard = InlineKeyboardMarkup([buttons]) if buttons else None
     
-    conn.close()
     return result, keyboard
 
 def get_user_language(user_id: int) -> str:
@@ -269,75 +592,46 @@ def get_user_language(user_id: int) -> str:
     return "en"  # Default to English
 
 # Command handlers
-@app.on_message(filters.command("new"))
 async def new_game(client: Client, message: Message):
     chat_id = message.chat.id
     lang = get_user_language(message.from_user.id)
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT word FROM games WHERE chat_id = ?", (chat_id,))
-    if c.fetchone():
-        await message.reply(LANGUAGES[lang]["game_in_progress"])
-        conn.close()
+    # Claim the chat in one step; an existing game wins and nothing touches SQLite
+    game = GameState(random.choice(WORDS_TUPLE), DEFAULT_SETTINGS.copy(), time.time(), lang)
+    if ACTIVE_GAMES.setdefault(chat_id, game) is not game:
+        await message.reply(MESSAGES[lang]["game_in_progress"]())
         return
     
-    settings = DEFAULT_SETTINGS.copy()
-    word = random.choice(WORDS)
-    c.execute("INSERT INTO games (chat_id, word, guesses, players, start_time, settings) VALUES (?, ?, ?, ?, ?, ?)",
-              (chat_id, word, "", "", time.time(), str(settings)))
-    c.execute("UPDATE bot_stats SET games_started = games_started + 1, last_updated = ? WHERE id = 1", (time.time(),))
-    conn.commit()
-    conn.close()
-    
-    await message.reply(LANGUAGES[lang]["new_game"].format(length=settings["word_length"]))
+    await DB.execute("INSERT INTO games (chat_id, word, start_time, settings) VALUES (?, ?, ?, ?)",
+                     (chat_id, game.word, game.start_time, json.dumps(game.settings)))
+    await DB.commit()
+    PENDING_BOT[0] += 1
     
-    # Schedule timeout
-    async def timeout_game():
-        await asyncio.sleep(settings["timeout"])
-        conn = get_db()
-        c = conn.cursor()
-        c.execute("SELECT word FROM games WHERE chat_id = ?", (chat_id,))
-        result = c.fetchone()
-        if result:
-            word = result[0]
-            c.execute("DELETE FROM games WHERE chat_id = ?", (chat_id,))
-            conn.commit()
-            await client.send_message(chat_id, LANGUAGES[lang]["game_ended"].format(word=word))
-        conn.close()
-    
-    asyncio.create_task(timeout_game())
+    await message.reply(MESSAGES[lang]["new_game"](length=game.settings["word_length"]))
+    schedule_timeout(chat_id, game)
 
-@app.on_message(filters.command("end") & filters.group)
 async def end_game(client: Client, message: Message):
     chat_id = message.chat.id
     user_id = message.from_user.id
     lang = get_user_language(user_id)
-    if not is_admin(chat_id, user_id, message):
-        await message.reply(LANGUAGES[lang]["admin_only"])
+    if not await is_admin(chat_id, user_id, message):
+        await message.reply(MESSAGES[lang]["admin_only"]())
         return
     
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT word FROM games WHERE chat_id = ?", (chat_id,))
-    result = c.fetchone()
-    if not result:
-        await message.reply(LANGUAGES[lang]["no_game"])
-        conn.close()
+    game = ACTIVE_GAMES.pop(chat_id, None)
+    if not game:
+        await message.reply(MESSAGES[lang]["no_game"]())
         return
     
-    word = result[0]
-    c.execute("DELETE FROM games WHERE chat_id = ?", (chat_id,))
-    conn.commit()
-    conn.close()
-    await message.reply(LANGUAGES[lang]["game_ended"].format(word=word))
+    await delete_game(chat_id)
+    await DB.commit()
+    await message.reply(MESSAGES[lang]["game_ended"](word=game.word))
 
-@app.on_message(filters.command("settings") & filters.group)
 async def update_settings(client: Client, message: Message):
     chat_id = message.chat.id
     user_id = message.from_user.id
     lang = get_user_language(user_id)
-    if not is_admin(chat_id, user_id, message):
-        await message.reply(LANGUAGES[lang]["admin_only"])
+    if not await is_admin(chat_id, user_id, message):
+        await message.reply(MESSAGES[lang]["admin_only"]())
         return
     
     args = message.command[1:]
@@ -354,39 +648,35 @@ async def update_settings(client: Client, message: Message):
         await message.reply("Invalid setting or value!")
         return
     
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT settings FROM games WHERE chat_id = ?", (chat_id,))
-    result = c.fetchone()
-    settings = eval(result[0]) if result else DEFAULT_SETTINGS.copy()
+    game = ACTIVE_GAMES.get(chat_id)
+    settings = game.settings if game else DEFAULT_SETTINGS.copy()
     settings[key] = value
-    c.execute("UPDATE games SET settings = ? WHERE chat_id = ?", (str(settings), chat_id))
-    conn.commit()
-    conn.close()
-    await message.reply(LANGUAGES[lang]["settings_updated"].format(settings=settings))
+    if game:
+        await DB.execute("UPDATE games SET settings = ? WHERE chat_id = ?", (json.dumps(settings), chat_id))
+        await DB.commit()
+        if key == "timeout":
+            schedule_timeout(chat_id, game)
+    await message.reply(MESSAGES[lang]["settings_updated"](settings=settings))
 
-@app.on_message(filters.command("help"))
 async def help_command(client: Client, message: Message):
     lang = get_user_language(message.from_user.id)
     settings = DEFAULT_SETTINGS  # Fetch from DB if needed
-    await message.reply(LANGUAGES[lang]["help"].format(length=settings["word_length"], max_guesses=settings["max_guesses"]))
+    await message.reply(MESSAGES[lang]["help"](length=settings["word_length"], max_guesses=settings["max_guesses"]))
 
-@app.on_message(filters.command("leaderboard"))
 async def leaderboard_command(client: Client, message: Message):
     chat_id = message.chat.id
     lang = get_user_language(message.from_user.id)
     args = message.command[1:]
     scope = args[0] if len(args) > 0 else "group"
-    period = args[1] if len(args) > 1 else "all"
+    period = args[1] if len(args) > 1 else "all_time"
     
-    if scope not in ["group", "global"] or period not in ["today", "week", "month", "all_time"]:
-        await message.reply("Usage: /leaderboard [global/group] [today/week/month/all]")
+    if scope not in ["group", "global"] or period not in PERIODS:
+        await message.reply("Usage: /leaderboard [global/group] [today/week/month/all_time]")
         return
     
-    result, keyboard = get_leaderboard(scope, chat_id, period)
-    await message.reply(LANGUAGES[lang]["leaderboard"].format(scope=scope, period=period, data=result), reply_markup=keyboard)
+    result, keyboard = await get_leaderboard(scope, chat_id, period)
+    await message.reply(MESSAGES[lang]["leaderboard"](scope=scope, period=period, data=result), reply_markup=keyboard)
 
-@app.on_message(filters.command("myscore"))
 async def myscore_command(client: Client, message: Message):
     user_id = message.from_user.id
     chat_id = message.chat.id
@@ -395,49 +685,36 @@ async def myscore_command(client: Client, message: Message):
     scope = args[0] if len(args) > 0 else "group"
     period = args[1] if len(args) > 1 else "all_time"
     
-    if scope not in ["group", "global"] or period not in ["today", "week", "month", "all_time"]:
-        await message.reply("Usage: /myscore [global/group] [today/week/month/all]")
+    if scope not in ["group", "global"] or period not in PERIODS:
+        await message.reply("Usage: /myscore [global/group] [today/week/month/all_time]")
         return
     
-    conn = get_db()
-    c = conn.cursor()
+    period_key = period_keys()[period]
     if scope == "group":
-        c.execute(f"SELECT {period} FROM scores WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
+        result = await fetch_one("SELECT wins FROM score_buckets WHERE user_id = ? AND chat_id = ? AND period_key = ?", (user_id, chat_id, period_key))
     else:
-        c.execute(f"SELECT SUM({period}) FROM scores WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    score = result[0] if result else 0
-    conn.close()
+        result = await fetch_one("SELECT SUM(wins) FROM score_buckets WHERE user_id = ? AND period_key = ?", (user_id, period_key))
+    score = result[0] if result and result[0] else 0
     
-    await message.reply(LANGUAGES[lang]["myscore"].format(scope=scope, period=period, score=score))
+    await message.reply(MESSAGES[lang]["myscore"](scope=scope, period=period, score=score))
 
-@app.on_message(filters.command("stats") & filters.private)
 async def stats_command(client: Client, message: Message):
     user_id = message.from_user.id
     lang = get_user_language(user_id)
     admin_ids = [123456789]  # Replace with actual admin IDs
     if user_id not in admin_ids:
-        await message.reply(LANGUAGES[lang]["admin_only"])
+        await message.reply(MESSAGES[lang]["admin_only"]())
         return
     
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT games_started, guesses_made FROM bot_stats WHERE id = 1")
-    games, guesses = c.fetchone()
-    conn.close()
-    await message.reply(LANGUAGES[lang]["stats"].format(games=games, guesses=guesses))
-
-@app.on_message(filters.command("profile"))
+    games, guesses = await fetch_one("SELECT games_started, guesses_made FROM bot_stats WHERE id = 1")
+    await message.reply(MESSAGES[lang]["stats"](games=games, guesses=guesses))
+
 async def profile_command(client: Client, message: Message):
     user_id = message.from_user.id
     lang = get_user_language(user_id)
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT games_played, wins, total_guesses FROM stats WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
+    result = await fetch_one("SELECT games_played, wins, total_guesses FROM stats WHERE user_id = ?", (user_id,))
     if not result:
         await message.reply("You haven't played any games yet!")
-        conn.close()
         return
     
     games_played, wins, total_guesses = result
@@ -448,10 +725,8 @@ async def profile_command(client: Client, message: Message):
     Wins: {wins}
     Average Guesses: {avg_guesses:.2f}
     """
-    conn.close()
     await message.reply(profile_text)
 
-@app.on_message(filters.command("language"))
 async def language_command(client: Client, message: Message):
     args = message.command[1:]
     if not args or args[0] not in LANGUAGES:
@@ -461,83 +736,137 @@ async def language_command(client: Client, message: Message):
     await message.reply(f"Language set to {args[0]}")
 
 # Callback query for leaderboard pagination
-@app.on_callback_query(filters.regex(r"leaderboard_(\w+)_(\w+)_(\d+)"))
+# Async on purpose: pyrogram runs sync filters through run_in_executor
+async def is_leaderboard_callback(_, __, query) -> bool:
+    return (query.data or "").startswith("leaderboard_")
+
+leaderboard_callback = filters.create(is_leaderboard_callback)
+
+@app.on_callback_query(leaderboard_callback)
+@sharded
 async def leaderboard_pagination(client: Client, callback_query):
-    scope, period, page = callback_query.data.split("_")[1:]
+    # data is leaderboard_{scope}_{period}_{page}; the period itself may contain "_" (all_time)
+    _, scope, rest = callback_query.data.split("_", 2)
+    period, page = rest.rsplit("_", 1)
     page = int(page)
     chat_id = callback_query.message.chat.id
     lang = get_user_language(callback_query.from_user.id)
-    result, keyboard = get_leaderboard(scope, chat_id, period, page)
+    result, keyboard = await get_leaderboard(scope, chat_id, period, page)
     await callback_query.message.edit_text(
-        LANGUAGES[lang]["leaderboard"].format(scope=scope, period=period, data=result),
+        MESSAGES[lang]["leaderboard"](scope=scope, period=period, data=result),
         reply_markup=keyboard
     )
 
 # Handle guesses
-@app.on_message(filters.text & ~filters.command)
 async def handle_guess(client: Client, message: Message):
     chat_id = message.chat.id
     user_id = message.from_user.id
     lang = get_user_language(user_id)
     guess = message.text.lower().strip()
     
+    game = ACTIVE_GAMES.get(chat_id)
+    if not game:
+        return
+    
     # Rate limiting
     now = time.time()
-    if user_id in user_last_guess and now - user_last_guess[user_id] < RATE_LIMIT:
+    tick = time.monotonic()
+    if tick - game.last_guess.get(user_id, float("-inf")) < RATE_LIMIT:
         await message.reply("Slow down! Wait a moment before guessing again.")
         return
-    user_last_guess[user_id] = now
-    
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT word, guesses, players, settings FROM games WHERE chat_id = ?", (chat_id,))
-    result = c.fetchone()
-    if not result:
-        conn.close()
-        return
-    
-    word, guesses, players, settings = result
-    settings = eval(settings)
-    guesses = eval(guesses) if guesses else []
-    players = eval(players) if players else set()
+    game.last_guess[user_id] = tick
+    word, settings = game.word, game.settings
     
     if len(guess) != settings["word_length"] or not guess.isalpha():
-        await message.reply(LANGUAGES[lang]["invalid_guess"].format(length=settings["word_length"]))
-        conn.close()
+        await message.reply(MESSAGES[lang]["invalid_guess"](length=settings["word_length"]))
         return
     
-    if guess not in WORDS:
-        await message.reply(LANGUAGES[lang]["not_valid_word"])
-        conn.close()
+    if guess not in WORDS_SET:
+        await message.reply(MESSAGES[lang]["not_valid_word"]())
         return
     
-    guesses.append((user_id, guess))
-    players.add(user_id)
-    c.execute("UPDATE games SET guesses = ?, players = ? WHERE chat_id = ?", (str(guesses), str(players), chat_id))
+    game.guess_count += 1
+    game.players.add(user_id)
+    guess_count = game.guess_count
+    PENDING_GUESSES.setdefault(chat_id, []).append((chat_id, guess_count, user_id, guess, now))
     update_stats(user_id, 1)
-    conn.commit()
     
     hint = get_hint(guess, word)
     if guess == word:
         update_score(user_id, chat_id)
-        c.execute("DELETE FROM games WHERE chat_id = ?", (chat_id,))
-        conn.commit()
-        conn.close()
-        user = await client.get_users(user_id)
-        await message.reply(LANGUAGES[lang]["win"].format(name=user.first_name, word=word))
+        del ACTIVE_GAMES[chat_id]
+        await delete_game(chat_id)
+        await DB.commit()
+        cache_user_name(user_id, message.from_user.first_name, now)
+        await message.reply(MESSAGES[lang]["win"](name=message.from_user.first_name, word=word))
         return
     
-    if len(guesses) >= settings["max_guesses"]:
-        c.execute("DELETE FROM games WHERE chat_id = ?", (chat_id,))
-        conn.commit()
-        conn.close()
-        await message.reply(LANGUAGES[lang]["game_over"].format(word=word))
+    if guess_count >= settings["max_guesses"]:
+        del ACTIVE_GAMES[chat_id]
+        await delete_game(chat_id)
+        await DB.commit()
+        await message.reply(MESSAGES[lang]["game_over"](word=word))
         return
     
-    conn.close()
-    await message.reply(LANGUAGES[lang]["guesses_left"].format(guess=guess, hint=hint, left=settings["max_guesses"] - len(guesses)))
+    await message.reply(MESSAGES[lang]["guesses_left"](guess=guess, hint=hint, left=settings["max_guesses"] - guess_count))
+
+# Message routing: one text handler and a dict lookup replace a pyrogram filter per command.
+# Values are (handler, allowed chat types or None for any chat).
+GROUP_CHATS = frozenset({ChatType.GROUP, ChatType.SUPERGROUP})
+PRIVATE_CHATS = frozenset({ChatType.PRIVATE})
+COMMAND_MAP = {
+    "new": (new_game, None),
+    "end": (end_game, GROUP_CHATS),
+    "settings": (update_settings, GROUP_CHATS),
+    "help": (help_command, None),
+    "leaderboard": (leaderboard_command, None),
+    "myscore": (myscore_command, None),
+    "stats": (stats_command, PRIVATE_CHATS),
+    "profile": (profile_command, None),
+    "language": (language_command, None),
+}
+
+@app.on_message(filters.text)
+@sharded
+async def route_message(client: Client, message: Message):
+    if not message.text.startswith("/"):
+        await handle_guess(client, message)
+        return
+    
+    parts = message.text.split()
+    name, _, mention = parts[0][1:].lower().partition("@")
+    if mention and mention != client.me.username.lower():
+        return
+    handler, chat_types = COMMAND_MAP.get(name, (None, None))
+    if handler is None or (chat_types and message.chat.type not in chat_types):
+        return
+    # Handlers read their arguments from message.command, as filters.command would set it
+    message.command = [name] + parts[1:]
+    await handler(client, message)
 
 # Start the bot
+async def on_startup():
+    await init_db()
+    await load_active_games()
+    start_workers()
+    spawn(flusher())
+    spawn(scheduler())
+    spawn(prune_scores())
+
+async def on_shutdown():
+    if DB:
+        await flush_pending()
+        await DB.close()
+
+async def main():
+    await on_startup()
+    try:
+        await app.start()
+        print("Bot is running...")
+        await idle()
+        await app.stop()
+    finally:
+        await on_shutdown()
+
 if __name__ == "__main__":
-    print("Bot is running...")
-    app.run()
+    app.run(main())